@@ -7,10 +7,32 @@
 #
 # SPDX-License-Identifier: MIT
 
-from micropython import const
-from machine import I2C
+import errno
 import time
 
+# Fall back to no-op equivalents so the module also imports on CPython.
+try:
+    import micropython
+    from micropython import const
+except ImportError:
+    class micropython:
+        native = staticmethod(lambda f: f)
+
+    def const(x):
+        return x
+
+try:
+    from machine import I2C
+except ImportError:
+    class I2C:
+        pass
+
+if not hasattr(time, "sleep_ms"):
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+if not hasattr(time, "ticks_ms"):
+    time.ticks_ms = lambda: int(time.monotonic() * 1000)
+    time.ticks_diff = lambda a, b: a - b
+
 # BH1750 I2C addresses
 _ADDR_LOW = const(0x23)  # ADDR pin low or floating
 _ADDR_HIGH = const(0x5C) # ADDR pin high (3.3V)
@@ -23,11 +45,43 @@ _RESET = const(0x07)      # Resets the data register value
 # The amount of time to wait in milliseconds after issuing a command
 _COMMAND_DELAY_MS = const(5)
 
+# Interval in milliseconds between data register polls while measuring
+_POLL_INTERVAL_MS = const(10)
+
+# Raw readings in this range converge predictably, so the poll can be bounded
+# by the typical rather than the max measurement time.
+_FAST_RAW_MIN = const(1000)
+_FAST_RAW_MAX = const(30000)
+
 # Measurement Time Register (MTreg) values
 _MTREG_MIN = const(31)
 _MTREG_MAX = const(254)
 _MTREG_DEFAULT = const(69)
 
+# Measurement times in milliseconds at the default MTreg (datasheet max/typical)
+_HIGH_RES_MS = const(180)
+_LOW_RES_MS = const(24)
+_HIGH_RES_TYP_MS = const(120)
+_LOW_RES_TYP_MS = const(16)
+
+# Mode opcode fields: 0x1X is continuous, 0x2X is one-shot; the low nibble
+# is 0 for high-res, 1 for high-res 2 and 3 for low-res.
+_ONE_SHOT_MASK = const(0xF0)
+_ONE_SHOT_VAL = const(0x20)
+_RES_MASK = const(0x0F)
+_RES_HIGH_2 = const(0x01)
+
+# Datasheet: lux = raw / 1.2 at the default MTreg, and lux scales with
+# default_mtreg / mtreg. Folding both gives lux * MTreg per count, which
+# _recalc_cached divides by the current MTreg. Floats cannot be const(), so
+# it is a plain module-level value computed once at import time.
+_LUX_DIV = 1.2
+_LUX_MTREG_PER_COUNT = _MTREG_DEFAULT / _LUX_DIV
+
+# Scratch buffer shared by all instances for single-byte command writes.
+# Writes are synchronous and the driver is not reentrant.
+_CMD_BUF = bytearray(1)
+
 # Measurement Modes
 CONTINUOUS_HIGH_RESOLUTION = const(0x10)   # 1.0 lx resolution, ~120-160 ms
 CONTINUOUS_HIGH_RESOLUTION_2 = const(0x11) # 0.5 lx resolution, ~120-160 ms
@@ -54,50 +108,62 @@ class BH1750:
         while True:
             print(f"Luminosity: {sensor.lux:.2f} lx")
             time.sleep(1)
+
+    When sampling infrequently in a continuous mode, pass auto_power=True to
+    power the sensor down after each reading; it is woken and restarted
+    transparently on the next one.
     """
-    def __init__(self, i2c: I2C, addr: int = None, mode: int = CONTINUOUS_HIGH_RESOLUTION, mtreg: int = _MTREG_DEFAULT):
+    def __init__(self, i2c: I2C, addr: int = None, mode: int = CONTINUOUS_HIGH_RESOLUTION, mtreg: int = _MTREG_DEFAULT, auto_power: bool = False):
         self.i2c = i2c
         self.addr = addr if addr is not None else self._autodetect_addr()
         self.mode = -1 # Initialize mode to an invalid state
+        self.mtreg = -1 # Initialize MTreg to an invalid state
+        self.auto_power = auto_power
+        self._powered_down = False
+        self._pending = False
 
-        # Pre-allocate buffers for memory efficiency
-        self._write_buf = bytearray(1)
+        # Pre-allocate the read buffer for memory efficiency
         self._read_buf = bytearray(2)
 
+        # No reset is needed here. A stale data register (e.g. after an MCU
+        # soft reset with the sensor still powered) is not mistaken for a
+        # result: set_mtreg and set_mode below record the register's value,
+        # and until the max measurement time has passed lux only accepts a
+        # value that differs from it.
         self.power_on()
-        self.reset()
 
         self.set_mtreg(mtreg)
         self.set_mode(mode, force=True)
 
     def _autodetect_addr(self) -> int:
-        """Scans the I2C bus to find the sensor's address."""
-        try:
-            addrs = self.i2c.scan()
-            if _ADDR_LOW in addrs:
-                return _ADDR_LOW
-            if _ADDR_HIGH in addrs:
-                return _ADDR_HIGH
-            raise OSError("BH1750 not found on I2C bus")
-        except OSError as e:
-            raise OSError(f"I2C scan failed: {e}")
-
+        """Probes the sensor's two possible addresses to find which one responds."""
+        for addr in (_ADDR_LOW, _ADDR_HIGH):
+            try:
+                self.i2c.writeto(addr, b'')
+                return addr
+            except OSError as e:
+                # No ACK shows up as ENODEV, or EIO on some ports; anything
+                # else (e.g. a stuck bus) is a real error.
+                if not e.args or e.args[0] not in (errno.ENODEV, errno.EIO):
+                    raise
+        raise OSError("BH1750 not found on I2C bus")
+
+    @micropython.native
     def _write_cmd(self, cmd: int):
         """Writes a single command byte to the sensor."""
-        try:
-            self._write_buf[0] = cmd
-            self.i2c.writeto(self.addr, self._write_buf)
-        except OSError as e:
-            raise OSError(f"BH1750 I2C write failed: {e}")
+        _CMD_BUF[0] = cmd
+        self.i2c.writeto(self.addr, _CMD_BUF)
 
     def power_on(self):
         """Powers on the sensor."""
         self._write_cmd(_POWER_ON)
+        self._powered_down = False
         time.sleep_ms(_COMMAND_DELAY_MS)
 
     def power_down(self):
         """Powers down the sensor, reducing power consumption."""
         self._write_cmd(_POWER_DOWN)
+        self._powered_down = True
 
     def reset(self):
         """Resets the sensor's data register. Valid only when powered on."""
@@ -111,15 +177,24 @@ class BH1750:
         Per the datasheet, this value adjusts the sensor's sensitivity and
         measurement time. Higher values increase sensitivity and duration.
 
+        Writes are skipped if the clamped value matches the current MTreg.
+
         Args:
             mtreg: An integer between 31 and 254.
         """
-        self.mtreg = max(_MTREG_MIN, min(mtreg, _MTREG_MAX))
+        mtreg = max(_MTREG_MIN, min(mtreg, _MTREG_MAX))
+        if self.mtreg == mtreg:
+            return
+        self.mtreg = mtreg
         # Two-part write, as per datasheet:
         high_byte = 0b0100_0000 | (self.mtreg >> 5)    # 01000_MT[7:5]
         low_byte = 0b0110_0000 | (self.mtreg & 0b0001_1111) # 011_MT[4:0]
+        self._stale_raw = self.raw
         self._write_cmd(high_byte)
         self._write_cmd(low_byte)
+        self._start_ms = time.ticks_ms()
+        self._pending = True
+        self._recalc_cached()
 
     def set_mode(self, mode: int, force: bool = False):
         """
@@ -135,9 +210,41 @@ class BH1750:
         if self.mode == mode and not force:
             return
         self.mode = mode
+        self._trigger()
+        self._recalc_cached()
+
+    def _trigger(self):
+        """Sends the mode command, which starts a new measurement."""
+        self._stale_raw = self.raw
         self._write_cmd(self.mode)
+        self._start_ms = time.ticks_ms()
+        self._pending = True
+
+    def _recalc_cached(self):
+        """Precomputes the wait time and lux scale for the current mode and MTreg."""
+        mode = self.mode
+        self._is_one_shot = (mode & _ONE_SHOT_MASK) == _ONE_SHOT_VAL
+        self._is_high_res = (mode & _RES_MASK) <= _RES_HIGH_2
+        self._is_hr2 = (mode & _RES_MASK) == _RES_HIGH_2
+
+        # Measurement times scale linearly with MTreg.
+        base_ms = _HIGH_RES_MS if self._is_high_res else _LOW_RES_MS
+        self._wait_ms = base_ms * self.mtreg // _MTREG_DEFAULT
+        typ_ms = _HIGH_RES_TYP_MS if self._is_high_res else _LOW_RES_TYP_MS
+        self._integration_ms = typ_ms * self.mtreg // _MTREG_DEFAULT
+
+        # Earlier counts were taken at a different resolution or sensitivity,
+        # so they can't predict how the next measurement converges.
+        self._last_raw = 0
+
+        # Lux calculation based on datasheet: lux = (raw / 1.2) * (default_mtreg / current_mtreg)
+        # The scaling factor of 1.2 is for when MTreg is at its default of 69.
+        # Per datasheet, the result must be divided by 2 for H-Resolution Mode 2.
+        scale = _LUX_MTREG_PER_COUNT * 0.5 if self._is_hr2 else _LUX_MTREG_PER_COUNT
+        self._lux_scale = scale / self.mtreg
 
     @property
+    @micropython.native
     def raw(self) -> int:
         """
         Reads the raw 16-bit sensor value.
@@ -145,44 +252,132 @@ class BH1750:
         Returns:
             The raw, unscaled sensor reading.
         """
-        try:
-            self.i2c.readfrom_into(self.addr, self._read_buf)
-            return (self._read_buf[0] << 8) | self._read_buf[1]
-        except OSError as e:
-            raise OSError(f"BH1750 I2C read failed: {e}")
+        buf = self._read_buf
+        self.i2c.readfrom_into(self.addr, buf)
+        return int.from_bytes(buf, 'big')
+
+    def _wake(self):
+        """Powers the sensor back on and restarts the continuous measurement."""
+        self.power_on()
+        self.reset()
+        self._trigger()
+
+    @micropython.native
+    def _read_settled(self) -> int:
+        """
+        Reads the data register once the measurement has settled.
+
+        The data register keeps the previous result until an integration
+        completes, and a slow sensor may take up to the max measurement time.
+        While a measurement started by a mode or MTreg write is pending, no
+        reading is taken before the typical measurement time, and until the
+        max time has passed only a value that differs from what the register
+        held before the write is accepted, once two consecutive reads agree.
+        If the previous reading was mid-scale, the first such value within
+        2x of it, but not equal to it, is accepted straight away.
+        """
+        if not self._pending:
+            # The register already holds a completed measurement
+            raw_val = self.raw
+            self._last_raw = raw_val
+            return raw_val
+
+        sleep_ms = time.sleep_ms
+        wait_ms = self._wait_ms
+        # ticks_diff is only valid for ticks less than TICKS_PERIOD/2 apart;
+        # an out-of-range age means the measurement is long done.
+        elapsed = time.ticks_diff(time.ticks_ms(), self._start_ms)
+        if not 0 <= elapsed < wait_ms:
+            elapsed = wait_ms
+        if elapsed < self._integration_ms:
+            sleep_ms(self._integration_ms - elapsed)
+            elapsed = self._integration_ms
+
+        stale = self._stale_raw
+        last = self._last_raw
+        fast = _FAST_RAW_MIN <= last <= _FAST_RAW_MAX
+        prev = -1
+        while True:
+            raw_val = self.raw
+            if elapsed >= wait_ms:
+                break
+            if raw_val != stale:
+                if raw_val == prev:
+                    break
+                # A value identical to the last reading may still be the
+                # old result, so only a fresh one takes the fast path.
+                if fast and raw_val != last and last <= raw_val * 2 and raw_val <= last * 2:
+                    break
+            prev = raw_val
+            sleep_ms(_POLL_INTERVAL_MS)
+            elapsed += _POLL_INTERVAL_MS
+
+        self._pending = False
+        self._last_raw = raw_val
+        return raw_val
 
     @property
+    @micropython.native
     def lux(self) -> float:
         """
         Reads the ambient light in lux.
 
         This property handles the necessary delays and commands for the
         configured measurement mode. For one-shot modes, it triggers a new
-        measurement on each call.
+        measurement on each call; in continuous modes, a powered-down sensor
+        is woken first. After a new measurement starts, the data register is
+        polled until it holds the new result, bounded by the datasheet's
+        maximum measurement time.
 
         Returns:
             The luminosity in lux.
         """
         # For one-shot modes, trigger a new measurement each time
-        is_one_shot = (self.mode & 0xF0) == 0x20
-        if is_one_shot:
-            self.set_mode(self.mode, force=True)
-
-        # Wait for the measurement to complete. The datasheet specifies a max
-        # measurement time of 180ms for high-res modes and 24ms for low-res.
-        base_ms = 180 if self.mode in (CONTINUOUS_HIGH_RESOLUTION, CONTINUOUS_HIGH_RESOLUTION_2, ONE_TIME_HIGH_RESOLUTION, ONE_TIME_HIGH_RESOLUTION_2) else 24
-        wait_ms = int(base_ms * (self.mtreg / _MTREG_DEFAULT))
-        time.sleep_ms(wait_ms)
-
-        # Read the raw value and scale it to lux
-        raw_val = self.raw
-        
-        # Lux calculation based on datasheet: lux = (raw / 1.2) * (default_mtreg / current_mtreg)
-        # The scaling factor of 1.2 is for when MTreg is at its default of 69.
-        lux = (raw_val / 1.2) * (_MTREG_DEFAULT / self.mtreg)
+        if self._is_one_shot:
+            self._trigger()
+        elif self._powered_down:
+            self._wake()
 
-        # Per datasheet, the result must be divided by 2 for H-Resolution Mode 2.
-        if self.mode in (CONTINUOUS_HIGH_RESOLUTION_2, ONE_TIME_HIGH_RESOLUTION_2):
-            lux /= 2.0
+        raw_val = self._read_settled()
+
+        # One-shot modes power down on their own after each measurement
+        if self.auto_power and not self._is_one_shot:
+            self.power_down()
 
-        return lux
\ No newline at end of file
+        return raw_val * self._lux_scale
+
+    def lux_many(self, n: int) -> float:
+        """
+        Reads the ambient light in lux, averaged over several measurements.
+
+        In continuous modes the settling poll is paid only once; the
+        remaining samples are spaced by the max measurement time, so each
+        one comes from a new integration even on a slower than typical
+        sensor. In one-shot modes each sample triggers its own measurement.
+
+        Args:
+            n: The number of samples to average, at least 1.
+
+        Returns:
+            The mean luminosity in lux.
+        """
+        if n < 1:
+            raise ValueError("n must be at least 1")
+
+        if self._is_one_shot:
+            acc = 0
+            for _ in range(n):
+                self._trigger()
+                acc += self._read_settled()
+        else:
+            if self._powered_down:
+                self._wake()
+            acc = self._read_settled()
+            sleep_ms = time.sleep_ms
+            for _ in range(n - 1):
+                sleep_ms(self._wait_ms)
+                acc += self.raw
+            if self.auto_power:
+                self.power_down()
+
+        return acc * self._lux_scale / n
@@ -1,23 +1,38 @@
 # test_bh1750.py
+import errno
 import sys
 import unittest
-from unittest.mock import MagicMock
 
 # --- Mock MicroPython environment ---
 # This must be done before importing the bh1750 module
-micropython_mock = MagicMock()
-# The real const() function just returns its input, so we mock it with a lambda.
-micropython_mock.const = lambda x: x
-sys.modules['micropython'] = micropython_mock
-sys.modules['machine'] = MagicMock()
+class _MicroPythonStub:
+    # The real const() function just returns its input.
+    const = staticmethod(lambda x: x)
+    # Native code emitter decorators are no-ops outside MicroPython.
+    native = staticmethod(lambda f: f)
+
+class _MachineStub:
+    I2C = type('I2C', (), {})
+
+sys.modules['micropython'] = _MicroPythonStub()
+sys.modules['machine'] = _MachineStub()
 
 import time
-# Manually add the missing 'sleep_ms' function to the standard time module
-time.sleep_ms = lambda ms: None # Do nothing during tests
+# Replace the MicroPython time functions with a simulated clock that only
+# advances when the driver sleeps, so tests run instantly.
+_clock_ms = 0
+
+def _sleep_ms(ms):
+    global _clock_ms
+    _clock_ms += max(0, ms)
+
+time.sleep_ms = _sleep_ms
+time.ticks_ms = lambda: _clock_ms
+time.ticks_diff = lambda a, b: a - b
 # --- End Mock ---
 
 # Now that the environment is mocked, we can import the driver
-from bh1750 import BH1750, CONTINUOUS_HIGH_RESOLUTION, CONTINUOUS_HIGH_RESOLUTION_2, ONE_TIME_HIGH_RESOLUTION, _ADDR_LOW, _POWER_ON, _POWER_DOWN, _RESET, _MTREG_MIN, _MTREG_MAX
+from bh1750 import BH1750, CONTINUOUS_HIGH_RESOLUTION, CONTINUOUS_HIGH_RESOLUTION_2, ONE_TIME_HIGH_RESOLUTION, _ADDR_LOW, _ADDR_HIGH, _POWER_ON, _POWER_DOWN, _RESET, _MTREG_MIN, _MTREG_MAX
 
 class MockI2C:
     """A mock I2C class to simulate machine.I2C for testing."""
@@ -25,20 +40,30 @@ class MockI2C:
         self.available_addrs = available_addrs if available_addrs is not None else []
         self.written_data = []
         self._read_data = b''
-
-    def scan(self):
-        return self.available_addrs
+        self._read_seq = None
+        self.read_count = 0
 
     def writeto(self, addr, buf, stop=True):
-        self.written_data.append(list(buf))
+        if addr not in self.available_addrs:
+            raise OSError(errno.ENODEV) # No device acknowledged the address
+        self.written_data.append(bytes(buf))
 
     def readfrom_into(self, addr, buf):
+        if self._read_seq:
+            self._read_data = self._read_seq[self.read_count % len(self._read_seq)]
+        self.read_count += 1
         for i in range(len(self._read_data)):
             buf[i] = self._read_data[i]
 
     def set_next_read_data(self, data):
+        self._read_seq = None
         self._read_data = data
 
+    def set_read_sequence(self, seq):
+        """Cycles subsequent reads through seq, one entry per read."""
+        self.read_count = 0
+        self._read_seq = seq
+
     def get_written_data(self):
         return self.written_data
 
@@ -46,6 +71,59 @@ class MockI2C:
         self.written_data = []
 
 
+class SimulatedI2C(MockI2C):
+    """
+    A time-aware mock that models the BH1750's data register.
+
+    The register keeps its previous value until an integration started by a
+    mode or MTreg write has run for typ_ms (scaled by MTreg). Passing a value
+    above the driver's 120 ms typical time models a slow sensor.
+    """
+    def __init__(self, lux, typ_ms=120, **kwargs):
+        super().__init__(**kwargs)
+        self.lux = lux
+        self.typ_ms = typ_ms
+        self.mode = None
+        self.mtreg = 69
+        self.register = 0
+        self._start_ms = None
+
+    def writeto(self, addr, buf, stop=True):
+        super().writeto(addr, buf, stop)
+        if not buf:
+            return
+        cmd = buf[0]
+        if cmd & 0xF8 == 0x40:
+            self.mtreg = (self.mtreg & 0x1F) | ((cmd & 0x07) << 5)
+        elif cmd & 0xE0 == 0x60:
+            self.mtreg = (self.mtreg & 0xE0) | (cmd & 0x1F)
+        elif cmd in (0x10, 0x11, 0x13, 0x20, 0x21, 0x23):
+            self.mode = cmd
+        else:
+            if cmd == 0x00:
+                self._start_ms = None # Powering down stops measuring
+            elif cmd == 0x07:
+                self.register = 0
+            return
+        self._start_ms = _clock_ms
+
+    def _integration_ms(self):
+        typ_ms = 16 if self.mode & 0x0F == 0x03 else self.typ_ms
+        return typ_ms * self.mtreg // 69
+
+    def readfrom_into(self, addr, buf):
+        self.read_count += 1
+        if self.mode is not None and self._start_ms is not None and _clock_ms - self._start_ms >= self._integration_ms():
+            counts = self.lux * 1.2 * self.mtreg / 69
+            if self.mode & 0x0F == 0x01:
+                counts *= 2
+            self.register = min(int(counts), 0xFFFF)
+            if self.mode & 0xF0 == 0x20:
+                self._start_ms = None
+        buf[0] = self.register >> 8
+        buf[1] = self.register & 0xFF
+
+
 class TestBH1750(unittest.TestCase):
 
     def setUp(self):
@@ -57,9 +135,17 @@ class TestBH1750(unittest.TestCase):
         sensor = BH1750(self.mock_i2c)
         self.assertEqual(sensor.addr, _ADDR_LOW)
         written = self.mock_i2c.get_written_data()
-        self.assertIn([_POWER_ON], written)
-        self.assertIn([_RESET], written)
-        self.assertIn([CONTINUOUS_HIGH_RESOLUTION], written)
+        self.assertIn(bytes([_POWER_ON]), written)
+        self.assertNotIn(bytes([_RESET]), written)
+        self.assertIn(bytes([CONTINUOUS_HIGH_RESOLUTION]), written)
+
+    def test_initialization_ignores_stale_register(self):
+        """Verify a value left in the register before init is not returned."""
+        for typ_ms in (120, 170):
+            i2c = SimulatedI2C(1000, typ_ms=typ_ms, available_addrs=[_ADDR_LOW])
+            i2c.register = 5000 # Left over from a previous configuration
+            sensor = BH1750(i2c, mtreg=138)
+            self.assertAlmostEqual(sensor.lux, 1000.0, delta=1.0)
 
     def test_autodetect_fails_if_no_device(self):
         """Verify that initialization fails if no sensor is found."""
@@ -67,6 +153,29 @@ class TestBH1750(unittest.TestCase):
         with self.assertRaisesRegex(OSError, "BH1750 not found on I2C bus"):
             BH1750(self.mock_i2c)
 
+    def test_autodetect_propagates_bus_errors(self):
+        """Verify bus errors other than a missing device are not reported as 'not found'."""
+        def writeto(addr, buf, stop=True):
+            raise OSError(errno.ETIMEDOUT)
+        self.mock_i2c.writeto = writeto
+        with self.assertRaises(OSError) as cm:
+            BH1750(self.mock_i2c)
+        self.assertEqual(cm.exception.args[0], errno.ETIMEDOUT)
+
+    def test_autodetect_propagates_bare_os_error(self):
+        """Verify an OSError without an errno propagates from autodetection."""
+        def writeto(addr, buf, stop=True):
+            raise OSError()
+        self.mock_i2c.writeto = writeto
+        with self.assertRaises(OSError):
+            BH1750(self.mock_i2c)
+
+    def test_autodetect_high_address(self):
+        """Verify autodetection falls back to the high address."""
+        self.mock_i2c.available_addrs = [_ADDR_HIGH]
+        sensor = BH1750(self.mock_i2c)
+        self.assertEqual(sensor.addr, _ADDR_HIGH)
+
     def test_lux_calculation(self):
         """Verify the lux calculation is correct with default MTreg."""
         sensor = BH1750(self.mock_i2c)
@@ -91,7 +200,14 @@ class TestBH1750(unittest.TestCase):
         self.mock_i2c.clear_written_data()
         sensor.set_mtreg(120)
         written = self.mock_i2c.get_written_data()
-        self.assertEqual(written, [[0x43], [0x78]])
+        self.assertEqual(written, [b'\x43', b'\x78'])
+
+    def test_set_mtreg_avoids_redundant_writes(self):
+        """Verify set_mtreg does not send commands if MTreg is unchanged."""
+        sensor = BH1750(self.mock_i2c, mtreg=120)
+        self.mock_i2c.clear_written_data()
+        sensor.set_mtreg(120)
+        self.assertEqual(self.mock_i2c.get_written_data(), [])
 
     def test_set_mtreg_clamps_low_value(self):
         """Verify set_mtreg clamps values lower than the minimum."""
@@ -110,7 +226,7 @@ class TestBH1750(unittest.TestCase):
         sensor = BH1750(self.mock_i2c)
         self.mock_i2c.clear_written_data()
         sensor.power_down()
-        self.assertEqual(self.mock_i2c.get_written_data(), [[_POWER_DOWN]])
+        self.assertEqual(self.mock_i2c.get_written_data(), [bytes([_POWER_DOWN])])
 
     def test_set_mode_avoids_redundant_writes(self):
         """Verify set_mode does not send a command if the mode is unchanged."""
@@ -127,13 +243,190 @@ class TestBH1750(unittest.TestCase):
         self.mock_i2c.set_next_read_data(b'\x00\x00')
         _ = sensor.lux
         written = self.mock_i2c.get_written_data()
-        self.assertIn([ONE_TIME_HIGH_RESOLUTION], written)
+        self.assertIn(bytes([ONE_TIME_HIGH_RESOLUTION]), written)
         
         self.mock_i2c.clear_written_data()
         self.mock_i2c.set_next_read_data(b'\x00\x00')
         _ = sensor.lux
         written = self.mock_i2c.get_written_data()
-        self.assertIn([ONE_TIME_HIGH_RESOLUTION], written)
+        self.assertIn(bytes([ONE_TIME_HIGH_RESOLUTION]), written)
+
+    def test_lux_returns_once_reading_settles(self):
+        """Verify lux stops polling once two consecutive new readings agree."""
+        i2c = SimulatedI2C(1000, available_addrs=[_ADDR_LOW])
+        sensor = BH1750(i2c)
+        start_ms = _clock_ms
+        self.assertAlmostEqual(sensor.lux, 1000.0, delta=1.0)
+        # New value read at the 120 ms typical time and confirmed 10 ms later
+        self.assertEqual(_clock_ms - start_ms, 130)
+
+    def test_lux_polls_until_timeout_on_unchanged_reading(self):
+        """Verify lux polls up to the max measurement time while the register is unchanged."""
+        self.mock_i2c.set_next_read_data(b'\xd5\x54')
+        sensor = BH1750(self.mock_i2c)
+        start_ms = _clock_ms
+        self.assertAlmostEqual(sensor.lux, 45510.0, places=1)
+        self.assertEqual(_clock_ms - start_ms, 180)
+
+    def test_lux_does_not_block_on_wrapped_ticks(self):
+        """Verify lux does not sleep on a negative ticks_diff from a stale timestamp."""
+        sensor = BH1750(self.mock_i2c)
+        self.mock_i2c.set_next_read_data(b'\xd5\x54')
+        _ = sensor.lux
+        sensor.set_mtreg(100)
+        ticks_diff = time.ticks_diff
+        time.ticks_diff = lambda a, b: -(1 << 29) # Timestamps past TICKS_PERIOD/2 apart
+        try:
+            start_ms = _clock_ms
+            _ = sensor.lux
+            _ = sensor.lux
+            self.assertLess(_clock_ms - start_ms, 1000)
+        finally:
+            time.ticks_diff = ticks_diff
+
+    def test_lux_waits_for_integration_after_mtreg_change(self):
+        """Verify lux does not return the stale register value after an MTreg change."""
+        i2c = SimulatedI2C(1000, available_addrs=[_ADDR_LOW])
+        sensor = BH1750(i2c)
+        self.assertAlmostEqual(sensor.lux, 1000.0, delta=1.0)
+        sensor.set_mtreg(138)
+        self.assertAlmostEqual(sensor.lux, 1000.0, delta=1.0)
+
+    def test_lux_waits_for_integration_after_mode_change(self):
+        """Verify lux does not return the stale register value after a mode change."""
+        i2c = SimulatedI2C(1000, available_addrs=[_ADDR_LOW])
+        sensor = BH1750(i2c)
+        self.assertAlmostEqual(sensor.lux, 1000.0, delta=1.0)
+        sensor.set_mode(CONTINUOUS_HIGH_RESOLUTION_2)
+        self.assertAlmostEqual(sensor.lux, 1000.0, delta=1.0)
+
+    def test_lux_waits_for_slow_sensor_after_mtreg_change(self):
+        """Verify lux rejects the stale register when integration exceeds the typical time."""
+        i2c = SimulatedI2C(1000, typ_ms=170, available_addrs=[_ADDR_LOW])
+        sensor = BH1750(i2c)
+        self.assertAlmostEqual(sensor.lux, 1000.0, delta=1.0)
+        sensor.set_mtreg(138)
+        self.assertAlmostEqual(sensor.lux, 1000.0, delta=1.0)
+
+    def test_one_shot_lux_waits_for_slow_sensor(self):
+        """Verify one-shot readings track the light when integration exceeds the typical time."""
+        i2c = SimulatedI2C(1000, typ_ms=170, available_addrs=[_ADDR_LOW])
+        sensor = BH1750(i2c, mode=ONE_TIME_HIGH_RESOLUTION)
+        self.assertAlmostEqual(sensor.lux, 1000.0, delta=1.0)
+        i2c.lux = 50
+        self.assertAlmostEqual(sensor.lux, 50.0, delta=1.0)
+        i2c.lux = 5000
+        self.assertAlmostEqual(sensor.lux, 5000.0, delta=1.0)
+
+    def test_one_shot_lux_does_not_return_previous_shot(self):
+        """Verify a one-shot reading reflects the new measurement, not the last one."""
+        i2c = SimulatedI2C(1000, available_addrs=[_ADDR_LOW])
+        sensor = BH1750(i2c, mode=ONE_TIME_HIGH_RESOLUTION)
+        self.assertAlmostEqual(sensor.lux, 1000.0, delta=1.0)
+        i2c.lux = 50
+        self.assertAlmostEqual(sensor.lux, 50.0, delta=1.0)
+
+    def test_lux_shortens_poll_after_mid_scale_reading(self):
+        """Verify the poll is bounded by the typical time after a mid-scale reading."""
+        sensor = BH1750(self.mock_i2c, mode=ONE_TIME_HIGH_RESOLUTION)
+        self.mock_i2c.set_next_read_data(b'\x27\x10') # 10000
+        _ = sensor.lux
+        # Alternate between two nearby values so the reading never settles
+        self.mock_i2c.set_read_sequence([b'\x27\x10', b'\x27\x11'])
+        start_ms = _clock_ms
+        _ = sensor.lux
+        # The first new value within 2x is accepted at the typical time
+        self.assertEqual(_clock_ms - start_ms, 120)
+
+    def test_fast_path_rejects_unchanged_reading(self):
+        """Verify a reading identical to the last one is confirmed rather than trusted."""
+        sensor = BH1750(self.mock_i2c, mode=ONE_TIME_HIGH_RESOLUTION)
+        self.mock_i2c.set_next_read_data(b'\x27\x10') # 10000
+        _ = sensor.lux
+        # The register differs before the trigger, then holds the last value
+        self.mock_i2c.set_read_sequence([b'\x23\x28'] + [b'\x27\x10'] * 30)
+        start_ms = _clock_ms
+        _ = sensor.lux
+        # Confirmed by a second read 10 ms after the 120 ms typical time
+        self.assertEqual(_clock_ms - start_ms, 130)
+
+    def test_config_change_clears_mid_scale_prediction(self):
+        """Verify a reading taken before an MTreg change does not shorten the poll."""
+        sensor = BH1750(self.mock_i2c, mode=ONE_TIME_HIGH_RESOLUTION)
+        self.mock_i2c.set_next_read_data(b'\x27\x10') # 10000
+        _ = sensor.lux
+        sensor.set_mtreg(138)
+        self.mock_i2c.set_read_sequence([b'\x27\x10', b'\x27\x11'])
+        start_ms = _clock_ms
+        _ = sensor.lux
+        # Polled from the 240 ms typical time until the 360 ms max
+        self.assertEqual(_clock_ms - start_ms, 360)
+
+    def test_lux_extends_poll_when_reading_strays(self):
+        """Verify the poll falls back to the max time if the reading moves by more than 2x."""
+        sensor = BH1750(self.mock_i2c, mode=ONE_TIME_HIGH_RESOLUTION)
+        self.mock_i2c.set_next_read_data(b'\x27\x10') # 10000
+        _ = sensor.lux
+        self.mock_i2c.set_next_read_data(b'\x00\x00')
+        start_ms = _clock_ms
+        _ = sensor.lux
+        # Polled from the 120 ms typical time until the 180 ms max
+        self.assertEqual(_clock_ms - start_ms, 180)
+
+    def test_lux_many_averages_with_single_wait(self):
+        """Verify lux_many reads each sample once, spaced by the max measurement time."""
+        sensor = BH1750(self.mock_i2c)
+        self.mock_i2c.set_next_read_data(b'\xd5\x54') # 54612
+        _ = sensor.lux
+        self.mock_i2c.read_count = 0
+        start_ms = _clock_ms
+        self.assertAlmostEqual(sensor.lux_many(5), 45510.0, places=1)
+        self.assertEqual(self.mock_i2c.read_count, 5)
+        # Remaining samples are spaced by the 180 ms max measurement time
+        self.assertEqual(_clock_ms - start_ms, 4 * 180)
+
+    def test_lux_many_one_shot_triggers_each_sample(self):
+        """Verify lux_many triggers a measurement per sample in one-shot mode."""
+        sensor = BH1750(self.mock_i2c, mode=ONE_TIME_HIGH_RESOLUTION)
+        self.mock_i2c.clear_written_data()
+        self.mock_i2c.set_next_read_data(b'\xd5\x54')
+        sensor.lux_many(3)
+        self.assertEqual(self.mock_i2c.get_written_data(), [bytes([ONE_TIME_HIGH_RESOLUTION])] * 3)
+
+    def test_lux_many_rejects_non_positive_count(self):
+        """Verify lux_many raises ValueError when asked for no samples."""
+        sensor = BH1750(self.mock_i2c)
+        with self.assertRaises(ValueError):
+            sensor.lux_many(0)
+
+    def test_auto_power_powers_down_after_read(self):
+        """Verify auto_power powers the sensor down after a continuous reading."""
+        sensor = BH1750(self.mock_i2c, auto_power=True)
+        self.mock_i2c.clear_written_data()
+        self.mock_i2c.set_next_read_data(b'\xd5\x54')
+        _ = sensor.lux
+        self.assertEqual(self.mock_i2c.get_written_data(), [bytes([_POWER_DOWN])])
+
+    def test_auto_power_wakes_sensor_before_next_read(self):
+        """Verify auto_power restarts the measurement on the next reading."""
+        sensor = BH1750(self.mock_i2c, auto_power=True)
+        self.mock_i2c.set_next_read_data(b'\xd5\x54')
+        _ = sensor.lux
+        self.mock_i2c.clear_written_data()
+        self.assertAlmostEqual(sensor.lux, 45510.0, places=1)
+        written = self.mock_i2c.get_written_data()
+        self.assertEqual(written, [bytes([_POWER_ON]), bytes([_RESET]), bytes([CONTINUOUS_HIGH_RESOLUTION]), bytes([_POWER_DOWN])])
+
+    def test_auto_power_wake_keeps_mid_scale_prediction(self):
+        """Verify waking the sensor does not discard the last reading."""
+        i2c = SimulatedI2C(1000, available_addrs=[_ADDR_LOW])
+        sensor = BH1750(i2c, auto_power=True)
+        _ = sensor.lux
+        i2c.lux = 1100
+        start_ms = _clock_ms
+        self.assertAlmostEqual(sensor.lux, 1100.0, delta=1.0)
+        # Power-on and reset delays, then the fast path at the typical time
+        self.assertEqual(_clock_ms - start_ms, 5 + 5 + 120)
 
 
 if __name__ == '__main__':